@@ -19,24 +19,22 @@
 #
 buff_path = '/data1/MyProject/raw2/MyProject_00008p71840c1b02_dump_00.000'
 
+import numpy as np
 import qass.tools.analyzer.buffer_parser as bp
 
-with bp.Buffer(buff_file) as buff:
-    column_list = ['times', 'spectrums', 'inputs']
+with bp.Buffer(buff_path) as buff:
+    # only request the columns used below, every additional column enlarges the resulting array
+    column_list = ['spectrums', 'inputs']
     meta_info = buff.block_infos(columns = column_list, changes_only=True)
     # ---- Here you already got the meta info. Below is just an example what you can do with it.
     
     
     #here you can filter for example you could check for a certain io values
     io_should_be = 5
-    for i, mi in enumerate(meta_info):
-        if mi[2] == io_should_be:
-            # the start spec is in the second column of this row:
-            start_idx = mi[1]
-            # the end spec is in the first column of the next row:
-            end_idx = meta_info[i+1, 1]
-            
-            data = buff.get_data(start_idx, end_idx)
-            #do something with the data in this region
-    
-
+    # the start spec of each region is in the first column of its row,
+    # the end spec is the start spec of the next row (or the end of the buffer for the last row)
+    end_specs = np.append(meta_info[1:, 0], buff.spec_count)
+    matches = meta_info[:, 1] == io_should_be
+    for start_idx, end_idx in zip(meta_info[matches, 0], end_specs[matches]):
+        data = buff.get_data(start_idx, end_idx)
+        #do something with the data in this region
@@ -17,14 +17,13 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
-import os, re, warnings
+import os, re, warnings, fnmatch
+from collections import defaultdict
 from typing import Any, Callable, Tuple, Union
-from sqlalchemy import Float, create_engine, Column, Integer, String, BigInteger, Identity, Index, Enum, TypeDecorator, select, text
+from sqlalchemy import Float, create_engine, Column, Integer, String, BigInteger, Identity, Index, TypeDecorator, select, insert, delete
 from sqlalchemy.orm import declarative_base, sessionmaker, Session
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.sql.selectable import Select
-from pathlib import Path
-from enum import Enum
 from tqdm.auto import tqdm
 
 from .buffer_parser import Buffer
@@ -34,19 +33,24 @@ __all__ = ["BufferMetadataCache", "BufferMetadata"]
 
 class BufferEnum(TypeDecorator):
     impl = String
+    # the type is fully described by enumtype which makes it safe to use in the statement cache key
+    cache_ok = True
+
     def __init__(self, enumtype, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self._enumtype = enumtype
+        self.enumtype = enumtype
 
     def process_bind_param(self, value, dialect):
         if value is None:
             return None
+        if isinstance(value, str):
+            return value
         return value.name
 
     def process_result_value(self, value, dialect):
         if value is None:
             return None
-        return self._enumtype[str(value)]
+        return self.enumtype[str(value)]
 
 __Base = declarative_base()
 class BufferMetadata(__Base):
@@ -114,11 +118,7 @@ class BufferMetadata(__Base):
         :param buffer: Buffer object
         :type buffer: buffer_parser.Buffer
         """
-        if "/" in buffer.filepath:
-            filename = buffer.filepath.split("/")[-1]
-        elif "\\" in buffer.filepath:
-            filename = buffer.filepath.split("\\")[-1]
-        directory_path = buffer.filepath[:-len(filename)]
+        directory_path, filename = BufferMetadataCache.split_filepath(buffer.filepath)
         buffer_metadata = BufferMetadata(filename = filename, directory_path = directory_path)
         for prop in BufferMetadata.properties:
             try: # try to map all the buffer properties and skip on error
@@ -127,6 +127,7 @@ class BufferMetadata(__Base):
                 continue
         return buffer_metadata
 
+_filepath_index = Index("directory_path_filename_index", BufferMetadata.directory_path, BufferMetadata.filename)
 Index("project_id_process_index", BufferMetadata.project_id, BufferMetadata.process)
 Index("project_id_process_channel_index", BufferMetadata.project_id, BufferMetadata.process, BufferMetadata.channel)
 Index("compression_time_frq_index", BufferMetadata.compression_time, BufferMetadata.compression_frq)
@@ -135,16 +136,31 @@ Index("project_id_compression_time_frq_index", BufferMetadata.project_id, Buffer
 class BufferMetadataCache:
     """This class acts as a Cache for Buffer Metadata. It uses a database session with a buffer_metadata table to map
     metadata to files on the disk. The cache can be queried a lot faster than manually opening a lot of buffer files.
+
+    :param Buffer_cls: The class used to open buffer files, defaults to Buffer
+    :type Buffer_cls: type, optional
+    :param db_url: The string used to create the engine. The default will create the database in main memory.
+    :type db_url: str, optional
+    :param engine: An instance of a sqlalchemy engine or an open connection. If provided it is used instead of creating
+        an engine from db_url. The sessions of the cache are bound to it.
+    :type engine: sqlalchemy.engine.Engine or sqlalchemy.engine.Connection, optional
     """
     BufferMetadata = BufferMetadata
+    # maximum number of values in a single IN (...) clause. Some database backends limit the number of
+    # bound parameters or the length of IN lists and planning time grows with their size.
+    IN_CLAUSE_CHUNK_SIZE = 500
 
-    def __init__(self, session=None, Buffer_cls=Buffer, db_url="sqlite:///:memory:"):
+    def __init__(self, session=None, Buffer_cls=Buffer, db_url="sqlite:///:memory:", engine=None):
         if session is not None:
             warnings.warn('The use of the session parameter is deprecated since version 2.3 and will be removed in two minor versions. Use the db_url keyword instead', DeprecationWarning, stacklevel=2)
             self.engine = session.get_bind()
+        elif engine is not None:
+            self.engine = engine
         else:
             self.engine = create_engine(db_url)
         BufferMetadata.metadata.create_all(self.engine)
+        # create_all skips the indexes of existing tables, caches created before this index was added need it as well
+        _filepath_index.create(self.engine, checkfirst=True)
         self.Session = sessionmaker(bind=self.engine)
         self.Buffer_cls = Buffer_cls
 
@@ -163,15 +179,31 @@ class BufferMetadataCache:
         """
         pattern = re.compile(regex_pattern)
         for path in paths:
-            if sync_subdirectories:
-                files = (str(file) for file in Path(path).rglob("*p*c?b*") if os.path.isfile(file) and pattern.match(str(file)))
-            else:
-                files = (str(file) for file in Path(path).glob("*p*c?b*") if os.path.isfile(file) and pattern.match(str(file)))
+            files = (file for file in self._scan_directory(path, sync_subdirectories) if pattern.match(file))
             unsynchronized_files, synchronized_missing_buffers = self.get_non_synchronized_files(files)
             if delete_stale_entries:
                 self.remove_files_from_cache(synchronized_missing_buffers, verbose = verbose)
             self.add_files_to_cache(unsynchronized_files, verbose = verbose)
 
+    @staticmethod
+    def _scan_directory(path, recursive):
+        """Yields the paths of the files in the directory whose names look like buffer files.
+        os.scandir provides the file type with the directory listing which saves a stat call per entry.
+
+        :param path: The path to the directory
+        :type path: str
+        :param recursive: When True the subdirectories are scanned as well (symlinked directories are not followed)
+        :type recursive: bool
+        """
+        directories = [path]
+        while directories:
+            with os.scandir(directories.pop()) as entries:
+                for entry in entries:
+                    if recursive and entry.is_dir(follow_symlinks = False):
+                        directories.append(entry.path)
+                    elif fnmatch.fnmatch(entry.name, "*p*c?b*") and entry.is_file():
+                        yield entry.path
+
     def synchronize_database(self, *sync_connections):
         # TODO
         pass
@@ -185,7 +217,9 @@ class BufferMetadataCache:
         """
         file_set = set(files)
         with self.Session() as session:
-            synchronized_buffers = set(buffer.filepath for buffer in session.query(self.BufferMetadata).all())
+            # only fetch the path columns instead of loading every entry as a BufferMetadata object
+            rows = session.execute(select(self.BufferMetadata.directory_path, self.BufferMetadata.filename))
+            synchronized_buffers = set(directory_path + filename for directory_path, filename in rows)
         unsynchronized_files = file_set.difference(synchronized_buffers)
         synchronized_missing_buffers = synchronized_buffers.difference(file_set)
         return unsynchronized_files, synchronized_missing_buffers
@@ -197,41 +231,57 @@ class BufferMetadataCache:
         :type files: list, tuple of str
         :param verbose: verbosity level. 0 = no feedback, 1 = progress bar
         :type verbose: int, optional
+        :param batch_size: number of entries that are inserted with a single statement, defaults to 1000
+        :type batch_size: int, optional
         """
+        # every row needs the same keys to be inserted with a single executemany statement
+        columns = [column for column in BufferMetadata.__table__.columns.keys() if column != "id"]
+        rows = []
         with self.Session() as session:
             files = tqdm(files, desc = "Adding Buffers") if verbose > 0 and len(files) > 0 else files
-            for i, file in enumerate(files):
+            for file in files:
                 try:
                     with self.Buffer_cls(file) as buffer:
                         buffer_metadata = BufferMetadata.buffer_to_metadata(buffer)
-                        session.add(buffer_metadata)
                 except Exception as e:
                     directory_path, filename = self.split_filepath(file)
-                    session.add(BufferMetadata(directory_path = directory_path, filename = filename, opening_error = str(e)))
+                    buffer_metadata = BufferMetadata(directory_path = directory_path, filename = filename, opening_error = str(e))
                     warnings.warn(f"One or more Buffers couldn't be opened {file}", UserWarning)
-                if i % batch_size == 0:
+                rows.append({column: getattr(buffer_metadata, column) for column in columns})
+                if len(rows) >= batch_size:
+                    session.execute(insert(BufferMetadata), rows)
                     session.commit()
+                    rows = []
+            if rows:
+                session.execute(insert(BufferMetadata), rows)
             session.commit()
 
     def remove_files_from_cache(self, files, verbose = 0):
-        '''Remove synchronized files from the cache
+        '''Remove synchronized files from the cache. Files that are not present in the cache are ignored.
 
         :param files: complete filepaths that are present in the cache
         :type files: list, tuple of str 
         :param verbose: verbosity level. 0 = no feedback, 1 = progress bar
         :type verbose: int, optional
         '''
+        # group the files by directory to delete them with one statement per directory
+        filenames_by_directory = defaultdict(list)
+        files = tqdm(files, desc = "Removing File Entries") if verbose > 0 and len(files) > 0 else files
+        for file in files:
+            directory_path, filename = self.split_filepath(file)
+            filenames_by_directory[directory_path].append(filename)
+
         with self.Session() as session:
-            files = tqdm(files, desc = "Removing File Entries") if verbose > 0 and len(files) > 0 else files
-            for file in files:
-                try:
-                    entry = session.query(BufferMetadata).filter_by(filepath = file).one()
-                    if not entry:
-                        continue
-                    session.delete(entry)
-                except Exception as e:
-                    session.rollback()
-                    raise e
+            chunk_size = self.IN_CLAUSE_CHUNK_SIZE
+            for directory_path, filenames in filenames_by_directory.items():
+                for i in range(0, len(filenames), chunk_size):
+                    try:
+                        session.execute(delete(BufferMetadata).where(
+                            BufferMetadata.directory_path == directory_path,
+                            BufferMetadata.filename.in_(filenames[i:i + chunk_size])))
+                    except Exception as e:
+                        session.rollback()
+                        raise e
             session.commit()
 
     def _deprecated_get_matching_metadata(self, buffer_metadata: BufferMetadata = None, filter_function: Callable = None,
@@ -239,7 +289,7 @@ class BufferMetadataCache:
         if (buffer_metadata is not None):
             q = self.get_buffer_metadata_query(buffer_metadata)
         elif filter_function is not None:
-            q = select(BufferMetadata).from_statement(text("SELECT * FROM buffer_metadata"))
+            q = select(BufferMetadata)
         else: raise ValueError("You need to provide either a BufferMetadata object or a filter function, or both")
         with self.Session() as session:
             metadata = list(session.execute(q).scalars())
@@ -259,11 +309,14 @@ class BufferMetadataCache:
                               sort_key: Callable = None, query: Select = None):
         """Query the cache for all BufferMetadata database entries matching 
 
-        :param query: A sqlalchemy select statement specifying the properties of the BufferMetadata objects
+        :param query: A sqlalchemy select statement specifying the properties of the BufferMetadata objects.
+            It can also be passed as the first positional argument.
         :type query: Select
         :return: A list with the paths to the buffer files that match the buffer_metadata
         :rtype: list[str]
         """
+        if isinstance(buffer_metadata, Select):
+            query, buffer_metadata = buffer_metadata, None
         if query is not None:
             return self._get_matching_metadata(query)
         warnings.warn("The usage of the parameters buffer_metadata, filter_function, sort_key is deprecated since version 2.3 and will be removed in two minor versions. Use the query parameter instead.", DeprecationWarning, stacklevel=2)
@@ -307,7 +360,8 @@ class BufferMetadataCache:
         :return: A list with the paths to the buffer files that match the buffer_metadata
         :rtype: list[str]
         """
-        if any(p is not None for p in (buffer_metadata, filter_function, sort_key)):
+        # a select statement passed as the first argument is dispatched by get_matching_metadata
+        if isinstance(buffer_metadata, BufferMetadata) or filter_function is not None or sort_key is not None:
             warnings.warn("The usage of the parameters buffer_metadata, filter_function, sort_key is deprecated since version 2.3 and will be removed in two minor versions. Use the query parameter instead.", DeprecationWarning, stacklevel=2)
 
         matching_metadata = self.get_matching_metadata(buffer_metadata, filter_function, sort_key, query)
@@ -320,7 +374,8 @@ class BufferMetadataCache:
         :return: List of Buffer objects
         :rtype: list
         """
-        if any(p is not None for p in (buffer_metadata, filter_function, sort_key)):
+        # a select statement passed as the first argument is dispatched by get_matching_metadata
+        if isinstance(buffer_metadata, BufferMetadata) or filter_function is not None or sort_key is not None:
             warnings.warn("The usage of the parameters buffer_metadata, filter_function, sort_key is deprecated since version 2.3 and will be removed in two minor versions. Use the query parameter instead.", DeprecationWarning, stacklevel=2)
 
         files = self.get_matching_files(buffer_metadata, filter_function, sort_key, query)
@@ -334,25 +389,21 @@ class BufferMetadataCache:
         return buffers
 
     def get_buffer_metadata_query(self, buffer_metadata):
-        """Converts a .. py:class:: BufferMetadata object to a complete query. Every property of the object will be converted into
-        SQL and returned as a ..py:class:: sqlalchemy.orm.query.FromStatement object
+        """Converts a .. py:class:: BufferMetadata object to a complete query. Every property of the object that is set
+        is converted into a filter criterion with a bound parameter. Queries built from templates with the same set
+        of properties share one compiled statement in the sqlalchemy statement cache.
 
         :param buffer_metadata: The template BufferMetadata object.
         :type buffer_metadata: BufferMetadata
         :return: The sqlalchemy query object
-        :rtype: sqlalchemy.orm.query.FromStatement
+        :rtype: sqlalchemy.sql.selectable.Select
         """
-        q = "SELECT * FROM buffer_metadata WHERE opening_error IS NULL AND "
+        criteria = [self.BufferMetadata.opening_error.is_(None)]
         for prop in self.BufferMetadata.properties:
             prop_value = getattr(buffer_metadata, prop)
             if prop_value is not None:
-                if isinstance(prop_value, str):
-                    prop_value = f"'{prop_value}'"
-                elif isinstance(prop_value, Enum):
-                    prop_value = f"'{prop_value.name}'"
-                q += f"{prop} = {prop_value} AND "
-        q = q[:-4]# prune the last AND
-        return select(BufferMetadata).from_statement(text(q))
+                criteria.append(getattr(self.BufferMetadata, prop) == prop_value)
+        return select(self.BufferMetadata).where(*criteria)
 
     @staticmethod
     def create_session(engine = None, db_url = "sqlite:///:memory:"):
@@ -370,6 +421,7 @@ class BufferMetadataCache:
             engine = create_engine(db_url)
         session = Session(engine)
         BufferMetadata.metadata.create_all(engine)
+        _filepath_index.create(engine, checkfirst=True)
         return session
 
 
@@ -377,17 +429,13 @@ class BufferMetadataCache:
     def split_filepath(filepath):
         """Splits a filepath to folder and filename and returns them as a tuple
 
-        :param filepath: _description_
+        :param filepath: The complete filepath, separated by either slashes or backslashes
         :type filepath: str
         :return: A tuple containing (directory_path, filename) as strings
         :rtype: tuple(str)
         """
-        if "/" in filepath:
-            filename = filepath.split("/")[-1]
-        elif "\\" in filepath:
-            filename = filepath.split("\\")[-1]
-        directory_path = filepath[:-len(filename)]
-        return directory_path, filename
+        idx = max(filepath.rfind("/"), filepath.rfind("\\")) + 1
+        return filepath[:idx], filepath[idx:]
 
 def get_declarative_base():
     """Getter for the declarative Base that is used by the :py:class:`BufferMetadataCache`.
@@ -19,12 +19,16 @@
 #
 
 # import modules
-from asyncio.log import logger
-import time
 import sys
+import time
 import os
+import re
+import stat
 import glob
-from typing import List, Union
+import fnmatch
+import heapq
+import contextlib
+from typing import List, Tuple, Union
 import shutil
 import logging, logging.handlers
 from pathlib import Path
@@ -42,6 +46,9 @@ class DeleteHandler():
     :param pattern: Flag if log file should be created (by default: False)
     :type log_entires: bool
     """
+    # seconds after the last modification of the directory until its listing is cached
+    LISTING_MTIME_RESOLUTION = 2
+
     def __init__(self, path: str, pattern: str, log_entries=False) -> None:
         """Constructor to connect a specific local directory path with a specific pattern parsed.
 
@@ -65,6 +72,20 @@ class DeleteHandler():
         self.pattern = pattern
         self.log_entries = log_entries
         self.full_path = str(Path(self.path) / Path(self.pattern))
+        # only the last component of the pattern is matched against the entries of the scanned directory
+        self._pattern_dir, self._name_pattern = os.path.split(self.pattern)
+        self._scan_path = os.path.join(str(self.path), self._pattern_dir)
+        name_pattern = os.path.normcase(self._name_pattern)
+        if name_pattern.startswith("*") and not glob.has_magic(name_pattern[1:]):
+            # the common "*.ext" patterns only need a suffix comparison
+            suffix = name_pattern[1:]
+            self._match_name = lambda name: name.endswith(suffix)
+        else:
+            # translate the pattern once instead of letting fnmatch look it up for every directory entry
+            self._match_name = re.compile(fnmatch.translate(name_pattern)).match
+        # matching files of the scanned directory, reused as long as the modification time of the directory does not change
+        self._listing = []
+        self._listing_mtime = None
         if self.log_entries:
             #logfilesize_limit = amount of entires * average entry size(=200bytes)
             logfilesize_limit = 10000 * 200
@@ -77,8 +98,8 @@ class DeleteHandler():
         :type max_amount: int
         """
         # search for files in directory which match pattern
-        delete_list = glob.glob(self.full_path) # delete_list is saved with full path
-        file_amount = len(delete_list)
+        files = self.__scan()
+        file_amount = len(files)
         if file_amount <= 0:
             if self.log_entries:
                 self.file_logger.warning("The current deleting directory has no matching files to delete. Check your pattern or check if the directory is correct.") 
@@ -88,10 +109,10 @@ class DeleteHandler():
         
         # if there are any files to delete:
         if amount_to_delete > 0:
-            # sort list for oldest files
-            sorted_list = self.__get_oldest(delete_list)
-            for idx in range(0, amount_to_delete):
-                self.__delete_file(sorted_list[idx][1])
+            # select the oldest files without sorting the complete list
+            with self.__open_directory() as dir_fd:
+                for creation_time, file, size in heapq.nsmallest(amount_to_delete, files):
+                    self.__delete_file(file, dir_fd)
             
         
     def delete_by_disk_space(self, disk_usage_limit: float) -> None:
@@ -107,59 +128,135 @@ class DeleteHandler():
         # calc free space that is required based on user limit
         target_free_space = disk_usage[0] * (1 - disk_usage_limit)
         # calc therefore required space
-        space_to_make = abs(target_free_space - disk_usage[2])
+        space_to_make = target_free_space - disk_usage[2]
         if space_to_make > 0:
-            delete_list = glob.glob(self.full_path) # delete_list is saved with full path
-            if len(delete_list) == 0:
+            files = self.__scan()
+            if len(files) == 0:
                 if self.log_entries:
                    self.file_logger.warning("The current deleting directory has no matching files to delete. Check your pattern or check if the directory is correct.") 
                 return
             # sort list for oldest files
-            sorted_list = self.__get_oldest(delete_list)
-            # helper
-            filesize = 0
-            #n = -1
-            for n, (date, file) in enumerate(sorted_list):
-                filesize = filesize + os.path.getsize(file)
-                if filesize >= space_to_make:
-                    break
-            for idx in range(0, n+1):
-                self.__delete_file(sorted_list[idx][1])
-
-    def __get_oldest(self, possible_files: List)   -> List:
-        """Private method to get a list of local files which are sorted by creation date.
-
-        :param possible_files: Everything in directory which matches pattern.
-        :type possible_files: List
-        :return: Sorted list with the oldest files as first entry.
-        :rtype: List
+            files.sort()
+            # delete the oldest files until their summed up size covers the required space
+            with self.__open_directory() as dir_fd:
+                for date, file, size in files:
+                    self.__delete_file(file, dir_fd)
+                    space_to_make -= size
+                    if space_to_make <= 0:
+                        break
+
+    def __scan(self) -> List[Tuple[float, str, int]]:
+        """Private method to list the files matching the pattern together with their creation time and size.
+        The directory is listed with os.scandir, the entries already know their type and cache their stat result.
+        Log files are ignored.
+
+        The matching files of the last scan are reused if the modification time of the directory did not change since then.
+        Their creation time and size are read again, files can change in place without touching the directory.
+
+        :return: List of (creation time, file path, file size) tuples in arbitrary order.
+        :rtype: List[Tuple[float, str, int]]
         """
-        # helper
-        creation_dates = []
-        for file in possible_files:
-            if str(file).endswith(".log"):
-                continue
-            # read out creation date (here: creation_time) of each file 
-            creation_time = os.path.getctime(file)
-            # convert to easy readable time
-            creation_time = time.ctime(creation_time)
-            # append to list
-            creation_dates.append(creation_time)
-        # zip file name and creation time
-        ziped_lists = zip(creation_dates, possible_files)
-        # sort for oldest
-        sorted_ziped_lists = sorted(ziped_lists, key=lambda x: x[0])
-        return sorted_ziped_lists
-    
-    def __delete_file(self, deleting_file: str) -> None:
+        if glob.has_magic(self._pattern_dir):
+            # the pattern spans multiple directories
+            files = []
+            for file in glob.glob(self.full_path):
+                if file.endswith(".log"):
+                    continue
+                try:
+                    file_stat = os.stat(file)
+                except FileNotFoundError:
+                    continue
+                if stat.S_ISREG(file_stat.st_mode):
+                    files.append((file_stat.st_ctime, file, file_stat.st_size))
+            return files
+
+        if not glob.has_magic(self._name_pattern):
+            # a pattern without wildcards matches at most one file, which can be looked up directly
+            file = os.path.join(self._scan_path, self._name_pattern)
+            try:
+                file_stat = os.stat(file)
+            except (FileNotFoundError, NotADirectoryError):
+                return []
+            if not stat.S_ISREG(file_stat.st_mode) or file.endswith(".log"):
+                return []
+            return [(file_stat.st_ctime, file, file_stat.st_size)]
+
+        try:
+            dir_stat = os.stat(self._scan_path)
+        except FileNotFoundError:
+            return []
+        if dir_stat.st_mtime_ns == self._listing_mtime:
+            files = []
+            for file in self._listing:
+                try:
+                    file_stat = os.stat(file)
+                except FileNotFoundError:
+                    continue
+                files.append((file_stat.st_ctime, file, file_stat.st_size))
+            return files
+
+        # like glob, wildcards do not match hidden files
+        match_hidden = self._name_pattern.startswith(".")
+        files = []
+        try:
+            with os.scandir(self._scan_path) as entries:
+                for entry in entries:
+                    name = entry.name
+                    if name.endswith(".log") or (name.startswith(".") and not match_hidden):
+                        continue
+                    if self._match_name(os.path.normcase(name)) and entry.is_file():
+                        try:
+                            entry_stat = entry.stat()
+                        except FileNotFoundError:
+                            # the file was deleted after the directory was read
+                            continue
+                        files.append((entry_stat.st_ctime, entry.path, entry_stat.st_size))
+        except FileNotFoundError:
+            return []
+        # files created within the timestamp resolution of the file system do not necessarily change the
+        # modification time of the directory, so the listing is only reused once the directory settled
+        if time.time() - dir_stat.st_mtime > self.LISTING_MTIME_RESOLUTION:
+            self._listing, self._listing_mtime = [file for creation_time, file, size in files], dir_stat.st_mtime_ns
+        else:
+            self._listing, self._listing_mtime = [], None
+        return files
+
+    @contextlib.contextmanager
+    def __open_directory(self):
+        """Private context manager that opens the scanned directory for the duration of a deleting sweep.
+        Files are unlinked relative to the directory descriptor, so the kernel does not have to resolve the complete path for every file.
+
+        :return: The directory file descriptor or None if the platform does not support dir_fd or the files are spread over multiple directories.
+        :rtype: Optional[int]
+        """
+        dir_fd = None
+        if os.unlink in os.supports_dir_fd and not glob.has_magic(self._pattern_dir):
+            try:
+                dir_fd = os.open(self._scan_path, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+            except OSError:
+                pass
+        try:
+            yield dir_fd
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+            # the cached listing contains the deleted files
+            self._listing, self._listing_mtime = [], None
+
+    def __delete_file(self, deleting_file: str, dir_fd: int = None) -> None:
         """Private method to delete parsed file. 
 
         :param deleting_file: File(path) that should be deletet.
         :type deleting_file: str
+        :param dir_fd: Descriptor of the directory containing the file, the file is removed by its name relative to it if given, defaults to None
+        :type dir_fd: int, optional
         :raises OSError: An error is raisen if files cannot be removed (arbitrary reasons).
         """
         try:
-            os.remove(deleting_file)
+            if dir_fd is None:
+                os.remove(deleting_file)
+            else:
+                os.unlink(os.path.basename(deleting_file), dir_fd=dir_fd)
             if self.log_entries:
                 self.file_logger.info(f"File: {deleting_file} removed sucessfull")
         except OSError as error:
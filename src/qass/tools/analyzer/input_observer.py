@@ -82,7 +82,7 @@ class InputObserver:
             io_specs_updates_raw = 15  # For hardware reasons the Optimizer4D records io changes every 15 raw specs.
             self._stream_update_specs = max(1, io_specs_updates_raw / stream.getCompressionTime())
         else:
-            self._stream_update_specs = self._update_time_ms * 1e6 / self._spec_duration()
+            self._stream_update_specs = self._update_time_ms * 1e6 / self._spec_duration
 
     def tick(self, ignore_getIO_exception: bool = False) -> None:
         """
@@ -96,6 +96,8 @@ class InputObserver:
         :type ignore_getIO_exception: bool
         """
         spec_duration = self._spec_duration
+        frq_band_count = self._frq_band_count
+        getIO = self._stream.getIO_inputs
         curr_spec = int(self._rti.getCurrentTime() // spec_duration)
         
         specs = np.arange(self._last_spec, curr_spec, self._stream_update_specs)
@@ -103,10 +105,10 @@ class InputObserver:
             self._last_spec = float(specs[-1])
         specs = specs.astype(int)#[int(s) for s in specs]
         for spec in specs:
-            stream_pos = spec * self._frq_band_count
+            stream_pos = spec * frq_band_count
             for idx, (byte, bit, state, delay) in enumerate(self._inputs):
                 try:
-                    curr_state = self._stream.getIO_inputs(stream_pos, byte, bit)
+                    curr_state = getIO(stream_pos, byte, bit)
                 except Exception as exc:
                     if ignore_getIO_exception:
                         break
@@ -18,8 +18,10 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
 from typing import Callable
+from collections import deque
+from threading import Lock
 import warnings
-from PySide2.QtCore import QObject, Signal, Slot, Qt, SIGNAL, QThread
+from PySide2.QtCore import QObject, Signal, Slot, Qt, QThread
 from PySide2.QtGui import QGuiApplication
 
 try:
@@ -32,12 +34,29 @@ except:
 __all__ = ["inMainThread"]
 
 class inMainThread(QObject):
+    # maximum number of queued asynchronous calls executed per event loop iteration
+    max_batch_size = 100
+
     def __init__(self, synchron=True):
         super().__init__()
         self.synchron = synchron
         # move self QObject to the main thread
-        main_thread = QGuiApplication.instance().thread()
-        self.moveToThread(main_thread)
+        self._main_thread = QGuiApplication.instance().thread()
+        self.moveToThread(self._main_thread)
+
+        # the Analyzer managers are looked up on the first cross-thread call
+        self._redirect_manager = None
+        self._debugger_manager = None
+
+        # asynchronous calls are queued and executed in batches by drain()
+        self._pending = deque()
+        self._pending_lock = Lock()
+        self._drain_scheduled = False
+
+        if self.synchron:
+            self.called.connect(self.execute, Qt.BlockingQueuedConnection)
+        else:
+            self.called.connect(self.drain, Qt.QueuedConnection)
 
     called = Signal()
     
@@ -46,25 +65,27 @@ class inMainThread(QObject):
         Invokes a method on the main thread. Taking care of garbage collection "bugs".
         """
         def inner_func(*args, **kwargs):
-            if QThread.currentThread() == QGuiApplication.instance().thread():
+            if QThread.currentThread() == self._main_thread:
                 return method(*args, **kwargs)
-            
-            self._method = method
-            
-            # do not garbage collect this self object until the function has finished.
-            self.setParent(QGuiApplication.instance())
-            
-            self.params = args
-            self.kwargs = kwargs
-            
-            self.stdout_redirector = OutputRedirect_Manager.getInstance().getCurrentOutRedirect()
-            self.stderr_redirector = OutputRedirect_Manager.getInstance().getCurrentErrRedirect()
-            self.debuggers = Analyzer.Debugger.DebuggerManager.getInstance().getCurrDebuggers()
-            
+
+            if self._redirect_manager is None:
+                # both are singletons, racing threads look up the same instances. The redirect manager is
+                # assigned last since it marks the lookup as done.
+                self._debugger_manager = Analyzer.Debugger.DebuggerManager.getInstance()
+                self._redirect_manager = OutputRedirect_Manager.getInstance()
+            redirect_manager = self._redirect_manager
+            call = (
+                method, args, kwargs,
+                redirect_manager.getCurrentOutRedirect(),
+                redirect_manager.getCurrentErrRedirect(),
+                self._debugger_manager.getCurrDebuggers()
+            )
+
             if self.synchron:
+                self._call = call
+                # do not garbage collect this self object until the function has finished.
+                self.setParent(QGuiApplication.instance())
                 # This function must not be called from the main thread - this would result in a deadlock
-                QObject.disconnect(self, SIGNAL('called()'), self.execute)
-                self.called.connect(self.execute, Qt.BlockingQueuedConnection)
                 self.called.emit()
                 # the result will only be available in the synchronous execution mode
 
@@ -73,35 +94,75 @@ class inMainThread(QObject):
                     raise exc
                 return self._result
             else:
-                QObject.disconnect(self, SIGNAL('called()'), self.execute)
-                self.called.connect(self.execute)
+                with self._pending_lock:
+                    self._pending.append(call)
+                    if self._drain_scheduled:
+                        # an already scheduled drain() picks this call up
+                        return
+                    self._drain_scheduled = True
+                    # do not garbage collect this self object until the queue has been drained.
+                    self.setParent(QGuiApplication.instance())
                 self.called.emit()
         
         return inner_func
 
     @Slot()
     def execute(self):
-        OutputRedirect_Manager.getInstance().registerStdOutHandler(self.stdout_redirector)
-        OutputRedirect_Manager.getInstance().registerStdErrHandler(self.stderr_redirector)
+        try:
+            self._result, self._exc_info = self._invoke(*self._call)
+        finally:
+            self._call = None
+            # decref self -> trigger garbage collector
+            self.setParent(None)
+
+    @Slot()
+    def drain(self):
+        """
+        Executes the queued asynchronous calls.
+        At most max_batch_size calls are executed at once, the remaining calls are rescheduled
+        to keep the event loop of the main thread responsive.
+        """
+        try:
+            for _ in range(self.max_batch_size):
+                with self._pending_lock:
+                    if not self._pending:
+                        break
+                    call = self._pending.popleft()
+                self._invoke(*call)
+        finally:
+            # also reached if a call raised, otherwise later calls would wait for a drain() that never comes
+            with self._pending_lock:
+                pending = bool(self._pending)
+                self._drain_scheduled = pending
+                if not pending:
+                    # decref self -> trigger garbage collector
+                    self.setParent(None)
+            if pending:
+                self.called.emit()
+
+    def _invoke(self, method, params, kwargs, stdout_redirector, stderr_redirector, debuggers):
+        redirect_manager = self._redirect_manager
+        debugger_manager = self._debugger_manager
+
+        redirect_manager.registerStdOutHandler(stdout_redirector)
+        redirect_manager.registerStdErrHandler(stderr_redirector)
         
-        for dbg in self.debuggers:
-            Analyzer.Debugger.DebuggerManager.getInstance().registerDebugger(dbg)
+        for dbg in debuggers:
+            debugger_manager.registerDebugger(dbg)
         
-        self._result = None
-        self._exc_info = None
+        result = None
+        exc_info = None
         
         try:
             # actually execute the wrapped method
-            self._result = self._method(*self.params, **self.kwargs)
-        except Exception as e:
+            result = method(*params, **kwargs)
+        except Exception:
             import sys
-            self._exception = e
-            self._exc_info = sys.exc_info()
+            exc_info = sys.exc_info()
         finally:
-            for dbg in self.debuggers:
-                Analyzer.Debugger.DebuggerManager.getInstance().unregisterDebugger(dbg)
+            for dbg in debuggers:
+                debugger_manager.unregisterDebugger(dbg)
 
-            OutputRedirect_Manager.getInstance().unregisterStdOutHandler(self.stdout_redirector)
-            OutputRedirect_Manager.getInstance().unregisterStdErrHandler(self.stderr_redirector)
-            # decref self -> trigger garbage collector
-            self.setParent(None)
+            redirect_manager.unregisterStdOutHandler(stdout_redirector)
+            redirect_manager.unregisterStdErrHandler(stderr_redirector)
+        return result, exc_info
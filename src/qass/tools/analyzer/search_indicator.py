@@ -72,9 +72,14 @@ class SearchIndicator:
         self._si.setFStartHz(stream.getLowFrequency() if not self._start_fband else self._start_fband * stream.getFrqPerBand())
         self._si.setFEndHz(stream.getHighFrequency() if not self._end_fband else self._end_fband * stream.getFrqPerBand())
 
+        # bind the methods used in tick() once per process
+        self._get_current_time = self._rti.getCurrentTime
+        self._set_tracking_time = self._si.setTrackingTime
+        self._set_output_value = self._out_connector.setOutputValue
+
     def tick(self):
         """
         The function tick has to bee called in every iteration of the operator network during the phase process_run().
         """
-        self._si.setTrackingTime(self._rti.getCurrentTime())
-        self._out_connector.setOutputValue(self._si)
+        self._set_tracking_time(self._get_current_time())
+        self._set_output_value(self._si)
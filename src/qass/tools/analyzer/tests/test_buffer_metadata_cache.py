@@ -17,34 +17,28 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
-import sys, datetime
-from uuid import uuid4
+import os, sys, datetime, warnings
 from enum import Enum
+from types import SimpleNamespace
 
 
 sys.path.append("../")
 sys.path.append("../../")
-from importlib import reload
 from qass.tools.analyzer import buffer_metadata_cache as bmc
 from qass.tools.analyzer.buffer_parser import Buffer
-from sqlalchemy import select, inspect
+from sqlalchemy import create_engine, event, select, insert, inspect
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
 import pytest
-reload(bmc)
 
 @pytest.fixture
 def mock_buffer():
-    class Mock_Buffer:
-        def __init__(self, filepath, *args): 
-            self.filepath = filepath
+    class Mock_Buffer(SimpleNamespace):
+        def __init__(self, filepath, *args):
+            super().__init__(filepath=filepath, process=1, channel=1, foo="foo")
         def __enter__(self):
             return self
         def __exit__(self, *args): pass
-        @property
-        def process(self): return 1
-        @property
-        def channel(self): return 1
-        @property
-        def foo(self): return "foo"
     return Mock_Buffer
 
 @pytest.fixture()
@@ -56,16 +50,93 @@ def buffer_objects():
         buffers.append(bmc.BufferMetadataCache.BufferMetadata(directory_path = "./", filename = file))
     return buffers
 
+@pytest.fixture(scope='session')
+def db_engine():
+    engine = create_engine("sqlite+pysqlite:///:memory:", poolclass=StaticPool,
+                           connect_args={"check_same_thread": False})
+
+    # pysqlite does not emit BEGIN itself which breaks SAVEPOINTs, let sqlalchemy control the transactions
+    @event.listens_for(engine, "connect")
+    def do_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def do_begin(connection):
+        connection.exec_driver_sql("BEGIN")
+
+    bmc.BufferMetadata.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture(scope='session')
+def db_connection(db_engine):
+    with db_engine.connect() as connection:
+        yield connection
+
+class SavepointSession(Session):
+    """A session that ends SAVEPOINTs of its connection instead of the transaction of the test.
+    Every transaction of the session joins a SAVEPOINT which is released by commit() and rolled back by rollback().
+    """
+    def __init__(self, bind, **kwargs):
+        super().__init__(bind = bind, **kwargs)
+        self._savepoint = bind.begin_nested()
+        event.listen(self, "after_transaction_end", self._restart_savepoint)
+
+    def _restart_savepoint(self, session, transaction):
+        # the SAVEPOINT ended together with the transaction, the next transaction needs a new one
+        if transaction.parent is None:
+            self._savepoint = self.get_bind().begin_nested()
+
+    def close(self):
+        event.remove(self, "after_transaction_end", self._restart_savepoint)
+        super().close()
+        if self._savepoint.is_active:
+            self._savepoint.rollback()
+
 @pytest.fixture(scope='function')
-def cache():
-    cache = bmc.BufferMetadataCache(Buffer)
-    return cache
+def cache(db_connection):
+    # every test runs inside a transaction that is rolled back afterwards,
+    # the sessions of the cache commit into SAVEPOINTs inside of it
+    transaction = db_connection.begin()
+    cache = bmc.BufferMetadataCache(Buffer_cls = Buffer, engine = db_connection)
+    cache.Session = sessionmaker(bind = db_connection, class_ = SavepointSession, expire_on_commit = False)
+    yield cache
+    transaction.rollback()
 
 def test_session_creation():
     cache = bmc.BufferMetadataCache()
     inspector = inspect(cache.engine)
     assert "buffer_metadata" in inspector.get_table_names()
 
+def test_engine_parameter():
+    engine = create_engine("sqlite+pysqlite:///:memory:")
+    cache = bmc.BufferMetadataCache(engine = engine)
+    assert cache.engine is engine
+    assert "buffer_metadata" in inspect(engine).get_table_names()
+
+def test_connection_as_engine_parameter():
+    engine = create_engine("sqlite+pysqlite:///:memory:")
+    with engine.connect() as connection:
+        cache = bmc.BufferMetadataCache(engine = connection)
+        with cache.Session() as session:
+            session.add(bmc.BufferMetadata(directory_path = "./", filename = "foop1c0b.000"))
+            session.commit()
+        assert cache.get_matching_files(query = select(bmc.BufferMetadata)) == ["./foop1c0b.000"]
+
+def test_filepath_index():
+    cache = bmc.BufferMetadataCache()
+    indexes = inspect(cache.engine).get_indexes("buffer_metadata")
+    assert any(index["column_names"] == ["directory_path", "filename"] for index in indexes)
+
+def test_filepath_index_existing_database(tmp_path):
+    db_url = f"sqlite:///{tmp_path / 'cache.db'}"
+    cache = bmc.BufferMetadataCache(db_url = db_url)
+    bmc._filepath_index.drop(cache.engine)
+    cache.engine.dispose()
+    cache = bmc.BufferMetadataCache(db_url = db_url)
+    indexes = inspect(cache.engine).get_indexes("buffer_metadata")
+    assert any(index["column_names"] == ["directory_path", "filename"] for index in indexes)
+
 @pytest.mark.parametrize('pre_added_files,new_files,unsynced_files,missing_files',
                          [
                              ([], ["./foop1c0b0.000", "./hellop1c0b0.000"], ["./foop1c0b0.000", "./hellop1c0b0.000"], []),
@@ -85,27 +156,31 @@ def test_get_non_synchronized_files(cache, pre_added_files, new_files, unsynced_
     for missing_file in missing_files:
         assert missing_file in synced_but_missing_files
 
-def test_get_non_synchronized_files_more_files(cache):
-    N = 1000
+@pytest.mark.parametrize('N,DUPLICATES', [(1000, 0), (1000, 100)])
+def test_get_non_synchronized_files_more_files(cache, N, DUPLICATES):
     path = "/home/"
-    files = [path + str(i) for i in range(N)]
+    files = [path + f"file_{i}" for i in range(N)]
+    duplicates = [f"duplicate_{i}" for i in range(DUPLICATES)]
+    with cache.Session() as session:
+        if duplicates:
+            session.execute(insert(bmc.BufferMetadata), [{"directory_path": path, "filename": filename} for filename in duplicates])
+            session.commit()
+    files += [path + filename for filename in duplicates]
     unsynchronized_files, _ = cache.get_non_synchronized_files(files)
-    assert len(unsynchronized_files) == len(files)
+    assert len(unsynchronized_files) == N
 
-def test_get_non_synchronized_files_more_files_duplicates(cache):
-    N = 1000
-    DUPLICATES = 100
+def test_remove_files_from_cache_chunked():
+    cache = bmc.BufferMetadataCache()
+    N = cache.IN_CLAUSE_CHUNK_SIZE * 2 + 1
     path = "/home/"
-    files = [str(uuid4()) for _ in range(N)]
+    filenames = [f"{i}p1c0b01.000" for i in range(N)]
     with cache.Session() as session:
-        for _ in range(DUPLICATES):
-            filename = str(uuid4())
-            file = path + filename
-            session.add(bmc.BufferMetadataCache.BufferMetadata(directory_path = path, filename = filename))
-            files.append(file)
+        session.execute(insert(bmc.BufferMetadata), [{"directory_path": path, "filename": filename} for filename in filenames])
         session.commit()
-    unsynchronized_files, _ = cache.get_non_synchronized_files(files)
-    assert len(unsynchronized_files) == N
+    cache.remove_files_from_cache([path + filename for filename in filenames[1:]])
+    with cache.Session() as session:
+        remaining_files = [b.filepath for b in session.query(bmc.BufferMetadata).all()]
+    assert remaining_files == [path + filenames[0]]
 
 def test_buffer_to_buffer_metadata(mock_buffer):
     buffer_metadata = bmc.BufferMetadata.buffer_to_metadata(mock_buffer("./foop1c0b.000"))
@@ -138,6 +213,15 @@ def test_add_files_to_cache(cache, mock_buffer):
         buffer_metadata = session.query(bmc.BufferMetadataCache.BufferMetadata).first()
     assert buffer_metadata.filename == "foop1c0b.000"
 
+def test_add_files_to_cache_batches(mock_buffer):
+    cache = bmc.BufferMetadataCache(Buffer_cls = mock_buffer)
+    files = [f"./foop{i}c0b01.000" for i in range(5)]
+    cache.add_files_to_cache(files, batch_size = 2)
+    with cache.Session() as session:
+        buffer_metadata = session.query(bmc.BufferMetadata).all()
+    assert sorted(b.filepath for b in buffer_metadata) == files
+    assert all(b.process == 1 and b.channel == 1 for b in buffer_metadata)
+
 def test_add_files_to_cache_warning(cache):
     class Buffer:
         def __init__(self, *args): 
@@ -149,19 +233,26 @@ def test_add_files_to_cache_warning(cache):
         buffer_metadata = session.query(bmc.BufferMetadataCache.BufferMetadata).first()
     assert buffer_metadata.filename == "foop1c0b.000"
 
-@pytest.mark.parametrize('pre_added_files,glob_return,files_in_cache,files_missing', [
+class MockDirEntry:
+    def __init__(self, path):
+        self.path = path
+        self.name = path.split("/")[-1]
+    def is_dir(self, *args, **kwargs): return False
+    def is_file(self, *args, **kwargs): return True
+
+@pytest.mark.parametrize('pre_added_files,scandir_return,files_in_cache,files_missing', [
     ([], ['./foop1c1b01.000'], ['./foop1c1b01.000'], []),
     (['./hoop1c1b01.000'], ['./foop1c1b01.000'], ['./foop1c1b01.000'], ['./hoop1c1b01.000']),
 ])
-def test_synchronize_directory(cache, mock_buffer, mocker, pre_added_files, glob_return, files_in_cache, files_missing):
+def test_synchronize_directory(cache, mock_buffer, mocker, pre_added_files, scandir_return, files_in_cache, files_missing):
     cache.Buffer_cls = mock_buffer
     with cache.Session() as session:
         for pre_added_file in pre_added_files:
             _, file = pre_added_file.split('/')
             session.add(bmc.BufferMetadataCache.BufferMetadata(directory_path = "./", filename = file))
             session.commit()
-    mocker.patch("qass.tools.analyzer.buffer_metadata_cache.Path.glob", return_value = glob_return)    
-    mocker.patch("os.path.isfile", return_value = True)
+    scandir_mock = mocker.patch("os.scandir")
+    scandir_mock.return_value.__enter__.return_value = [MockDirEntry(file) for file in scandir_return]
     cache.synchronize_directory("./", sync_subdirectories = False, delete_stale_entries = True)
     with cache.Session() as session:
         actual_files_in_cache = [b.filepath for b in session.query(bmc.BufferMetadata).all()]
@@ -170,6 +261,20 @@ def test_synchronize_directory(cache, mock_buffer, mocker, pre_added_files, glob
     for file in files_missing:
         assert file not in actual_files_in_cache
 
+@pytest.mark.parametrize('sync_subdirectories,expected_files', [
+    (False, ['foop1c1b01.000']),
+    (True, ['foop1c1b01.000', 'sub/barp2c0b01.000']),
+])
+def test_synchronize_directory_subdirectories(cache, mock_buffer, tmp_path, sync_subdirectories, expected_files):
+    cache.Buffer_cls = mock_buffer
+    (tmp_path / "sub").mkdir()
+    for file in ('foop1c1b01.000', 'sub/barp2c0b01.000', 'notes.txt', 'sub/notes.txt'):
+        (tmp_path / file).touch()
+    cache.synchronize_directory(str(tmp_path), sync_subdirectories = sync_subdirectories)
+    with cache.Session() as session:
+        actual_files_in_cache = sorted(b.filepath for b in session.query(bmc.BufferMetadata).all())
+    assert actual_files_in_cache == [os.path.join(str(tmp_path), *file.split('/')) for file in expected_files]
+
 def test_get_matching_files_single_property(cache, mock_buffer):
     with cache.Session() as session:
         cache.Buffer_cls = mock_buffer
@@ -178,9 +283,10 @@ def test_get_matching_files_single_property(cache, mock_buffer):
         session.add(bmc.BufferMetadataCache.BufferMetadata(directory_path = "./", filename = "barp1c0b.000", process = 1))
         session.commit()
     query = select(bmc.BufferMetadata).filter(bmc.BufferMetadata.process==1)
-    assert "./foop1c0b.000" in cache.get_matching_files(query)
-    assert "./barp1c0b.000" in cache.get_matching_files(query)
-    assert not "./hoop1c0b.000" in cache.get_matching_files(query)
+    matching_files = cache.get_matching_files(query)
+    assert "./foop1c0b.000" in matching_files
+    assert "./barp1c0b.000" in matching_files
+    assert not "./hoop1c0b.000" in matching_files
     
 def test_get_matching_files_multiple_properties(cache, mock_buffer):
     with cache.Session() as session:
@@ -195,20 +301,36 @@ def test_get_matching_files_multiple_properties(cache, mock_buffer):
                                                            filename = "foo_barp1c0b.000", process=1, channel=2, frq_bands=512))
         session.commit()
     query = select(bmc.BufferMetadata).filter(bmc.BufferMetadata.process==1)
-    assert "./foop1c0b.000" in cache.get_matching_files(query)
-    assert not "./hoop1c0b.000" in cache.get_matching_files(query)
-    assert "./barp1c0b.000" in cache.get_matching_files(query)
-    assert "./foo_barp1c0b.000" in cache.get_matching_files(query)
+    matching_files = cache.get_matching_files(query)
+    assert "./foop1c0b.000" in matching_files
+    assert not "./hoop1c0b.000" in matching_files
+    assert "./barp1c0b.000" in matching_files
+    assert "./foo_barp1c0b.000" in matching_files
     query = select(bmc.BufferMetadata).filter(bmc.BufferMetadata.process==1, bmc.BufferMetadata.channel==1)
-    assert not "./foop1c0b.000" in cache.get_matching_files(query)
-    assert not "./hoop1c0b.000" in cache.get_matching_files(query)
-    assert "./barp1c0b.000" in cache.get_matching_files(query)
-    assert not "./foo_barp1c0b.000" in cache.get_matching_files(query)
+    matching_files = cache.get_matching_files(query)
+    assert not "./foop1c0b.000" in matching_files
+    assert not "./hoop1c0b.000" in matching_files
+    assert "./barp1c0b.000" in matching_files
+    assert not "./foo_barp1c0b.000" in matching_files
     query = select(bmc.BufferMetadata).filter(bmc.BufferMetadata.frq_bands==16, bmc.BufferMetadata.channel==1)
-    assert not "./foop1c0b.000" in cache.get_matching_files(query)
-    assert not "./hoop1c0b.000" in cache.get_matching_files(query)
-    assert "./barp1c0b.000" in cache.get_matching_files(query)
-    assert not "./foo_barp1c0b.000" in cache.get_matching_files(query)
+    matching_files = cache.get_matching_files(query)
+    assert not "./foop1c0b.000" in matching_files
+    assert not "./hoop1c0b.000" in matching_files
+    assert "./barp1c0b.000" in matching_files
+    assert not "./foo_barp1c0b.000" in matching_files
+
+def test_get_matching_positional_query(cache, mock_buffer):
+    cache.Buffer_cls = mock_buffer
+    with cache.Session() as session:
+        session.add(bmc.BufferMetadata(directory_path = "./", filename = "foop1c0b.000", process = 1))
+        session.add(bmc.BufferMetadata(directory_path = "./", filename = "hoop1c0b.000", process = 2))
+        session.commit()
+    query = select(bmc.BufferMetadata).filter(bmc.BufferMetadata.process==1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        assert [m.filename for m in cache.get_matching_metadata(query)] == ["foop1c0b.000"]
+        assert cache.get_matching_files(query) == ["./foop1c0b.000"]
+        assert [b.filepath for b in cache.get_matching_buffers(query)] == ["./foop1c0b.000"]
 
 def test_buffermetadata_constructor():
     class TestEnum(Enum):
@@ -227,13 +349,29 @@ def test_get_matching_files_enum_properties(cache, mock_buffer):
     query = select(bmc.BufferMetadata).filter(
         bmc.BufferMetadata.process==1, 
         bmc.BufferMetadata.datatype==Buffer.DATATYPE.COMP_MOV_AVERAGE)
-    assert "./foop1c0b.000" in cache.get_matching_files(query)
+    matching_files = cache.get_matching_files(query)
+    assert "./foop1c0b.000" in matching_files
+
+def test_get_matching_files_buffer_metadata_template(cache):
+    with cache.Session() as session:
+        session.add(bmc.BufferMetadata(directory_path = "./", filename = "foop1c0b.000", process = 1, datatype = Buffer.DATATYPE.COMP_MOV_AVERAGE))
+        session.add(bmc.BufferMetadata(directory_path = "./", filename = "hoop1c0b.000", process = 2, datatype = Buffer.DATATYPE.COMP_MOV_AVERAGE))
+        session.add(bmc.BufferMetadata(directory_path = "./", filename = "barp1c0b.000", process = 1, opening_error = "error"))
+        session.commit()
+    with pytest.warns(DeprecationWarning):
+        files = cache.get_matching_files(buffer_metadata = bmc.BufferMetadata(process = 1, datatype = Buffer.DATATYPE.COMP_MOV_AVERAGE))
+    assert files == ["./foop1c0b.000"]
+    with pytest.warns(DeprecationWarning):
+        files = cache.get_matching_files(buffer_metadata = bmc.BufferMetadata(process = 2))
+    assert files == ["./hoop1c0b.000"]
 
 @pytest.mark.parametrize("filepath,directory_path,filename", [
     ("./foo/bar/hoo", "./foo/bar/", "hoo"), 
     ("\\hello\\file\\filename", "\\hello\\file\\", "filename"),
     ('./foop1c0b.000', './', 'foop1c0b.000'),
     ('./foop1c0b01.000', './', 'foop1c0b01.000'),
+    ('C:\\data/foop1c0b01.000', 'C:\\data/', 'foop1c0b01.000'),
+    ('foop1c0b01.000', '', 'foop1c0b01.000'),
 ])
 def test_split_filepath(filepath, directory_path, filename):
     path, f_name = bmc.BufferMetadataCache.split_filepath(filepath)
@@ -1,5 +1,3 @@
-import pytest
-from unittest.mock import MagicMock
 from qass.tools.analyzer.buffer_parser import Buffer
 import pickle
 
@@ -17,9 +17,9 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 #
-import glob
 from  qass.tools.analyzer.deleting_process import DeleteHandler
 from pathlib import Path
+import contextlib
 import os
 import shutil
 import pytest
@@ -32,85 +32,172 @@ def deletehandler_obj_helper(tmp_path):
     obj = DeleteHandler(tmp_path, pattern)
     return obj
 
-@pytest.fixture
-def deletehandler_obj_helper_two(tmp_path):
-    pattern = "*.txt"
-    obj = DeleteHandler(tmp_path, pattern, log_entries=True)
-    return obj
+def create_files(directory, amount):
+    for n in range(amount):
+        fd = os.open(str(directory / f"file{n}.txt"), os.O_CREAT | os.O_WRONLY, 0o644)
+        os.write(fd, b"0" * 25)
+        os.close(fd)
 
-@pytest.fixture
-def get_oldest_helper(monkeypatch):
-    def get_oldest_wrapper(self, some_list):
-        test_list = [('Tue Jul  5 11:47:07 2022', '/home/opti/tmp_dir/Text File.txt'), ('Tue Jul  5 11:47:14 2022', '/home/opti/tmp_dir/Text File (1).txt'), ('Tue Jun 14 16:49:34 2022', '/home/opti/tmp_dir/file1.txt')]
-        return test_list
-    
-    monkeypatch.setattr(DeleteHandler, "_DeleteHandler__get_oldest", get_oldest_wrapper)
-
-def test_delete_by_amount(monkeypatch, deletehandler_obj_helper, get_oldest_helper):
+@pytest.mark.parametrize('log_entries', [False, True])
+def test_delete_by_amount(monkeypatch, tmp_path, log_entries):
     # Arrange
     amount_limit = 1
     os_mock = Mock()
-    len_mock = Mock(return_value=[0,1,2])
-    monkeypatch.setattr(glob, "glob",len_mock)
+    create_files(tmp_path, 3)
     monkeypatch.setattr(os, "remove", os_mock)
+    monkeypatch.setattr(os, "unlink", os_mock)
+    handler = DeleteHandler(tmp_path, "*.txt", log_entries=log_entries)
+    expected_path = tmp_path / Path("*.txt" + ".log")
     
     # Act
-    deletehandler_obj_helper.delete_by_amount(amount_limit)
+    handler.delete_by_amount(amount_limit)
     
     # Assert
     assert os_mock.call_count == 2
+    assert os.path.exists(expected_path) == log_entries
+
+def test_delete_by_amount_keeps_newest(tmp_path):
+    # Arrange
+    create_files(tmp_path, 3)
+    (tmp_path / "other.dat").touch()
+    handler = DeleteHandler(tmp_path, "*.txt")
+    # files created back to back can share their ctime, the handler breaks these ties by path
+    newest = max(tmp_path.glob("*.txt"), key=lambda file: (file.stat().st_ctime, str(file)))
+
+    # Act
+    handler.delete_by_amount(1)
+
+    # Assert
+    assert [file.name for file in tmp_path.glob("*.txt")] == [newest.name]
+    assert (tmp_path / "other.dat").exists()
 
-def test_delete_by_disk_space(monkeypatch, deletehandler_obj_helper, get_oldest_helper):
+@pytest.mark.skipif(os.unlink not in os.supports_dir_fd, reason="os.unlink does not support dir_fd on this platform")
+def test_delete_by_amount_relative_to_directory(monkeypatch, tmp_path):
+    # Arrange
+    create_files(tmp_path, 3)
+    # os.unlink stays unpatched, the files are removed relative to the opened directory instead of by their path
+    remove_mock = Mock()
+    monkeypatch.setattr(os, "remove", remove_mock)
+    handler = DeleteHandler(tmp_path, "*.txt")
+
+    # Act
+    handler.delete_by_amount(1)
+
+    # Assert
+    assert remove_mock.call_count == 0
+    assert [file.name for file in tmp_path.glob("*.txt")] == ["file2.txt"]
+
+@pytest.mark.parametrize('log_entries', [False, True])
+def test_delete_by_disk_space(monkeypatch, tmp_path, log_entries):
     # Arrange
     usage_limit = 0.9
 
     os_mock = Mock()
     shutil_mock = Mock(return_value=(1000, 950, 50))
-    filesize_mock = Mock(return_value=25)
-    len_mock = Mock(return_value=[0,1,2])
+    create_files(tmp_path, 3)
     monkeypatch.setattr(shutil, "disk_usage", shutil_mock)
     monkeypatch.setattr(os, "remove", os_mock)
-    monkeypatch.setattr(glob, "glob",len_mock)
-    monkeypatch.setattr(os.path, "getsize", filesize_mock)
+    monkeypatch.setattr(os, "unlink", os_mock)
+    handler = DeleteHandler(tmp_path, "*.txt", log_entries=log_entries)
+    expected_path = tmp_path / Path("*.txt" + ".log")
     
     # Act
-    deletehandler_obj_helper.delete_by_disk_space(usage_limit)
+    handler.delete_by_disk_space(usage_limit)
     
     # Assert
     assert os_mock.call_count == 2
+    assert os.path.exists(expected_path) == log_entries
 
-def test_delete_by_amount_two(monkeypatch, deletehandler_obj_helper_two, tmp_path, get_oldest_helper):
+def test_delete_by_disk_space_below_limit(monkeypatch, deletehandler_obj_helper, tmp_path):
     # Arrange
-    amount_limit = 1
+    usage_limit = 0.9
+
     os_mock = Mock()
-    len_mock = Mock(return_value=[0,1,2])
-    monkeypatch.setattr(glob, "glob",len_mock)
+    shutil_mock = Mock(return_value=(1000, 850, 150))
+    create_files(tmp_path, 3)
+    monkeypatch.setattr(shutil, "disk_usage", shutil_mock)
     monkeypatch.setattr(os, "remove", os_mock)
-    expected_path = tmp_path / Path("*.txt" + ".log")
+    monkeypatch.setattr(os, "unlink", os_mock)
     
     # Act
-    deletehandler_obj_helper_two.delete_by_amount(amount_limit)
+    deletehandler_obj_helper.delete_by_disk_space(usage_limit)
     
     # Assert
-    assert os_mock.call_count == 2
-    assert os.path.exists(expected_path)
+    assert shutil_mock.call_count == 1
+    assert os_mock.call_count == 0
 
-def test_delete_by_disk_space_two(monkeypatch, deletehandler_obj_helper_two, tmp_path, get_oldest_helper):
+def test_listing_is_reused_until_directory_changes(monkeypatch, tmp_path):
     # Arrange
-    usage_limit = 0.9
+    create_files(tmp_path, 3)
+    past = os.stat(tmp_path).st_mtime - 10
+    os.utime(tmp_path, (past, past))
+    handler = DeleteHandler(tmp_path, "*.txt")
+    handler.delete_by_amount(3)
+    scandir_mock = Mock(wraps=os.scandir)
+    monkeypatch.setattr(os, "scandir", scandir_mock)
+
+    # Act
+    handler.delete_by_amount(3)
+    create_files(tmp_path, 4)
+    handler.delete_by_amount(3)
+
+    # Assert
+    assert scandir_mock.call_count == 1
+    assert len(list(tmp_path.glob("*.txt"))) == 3
 
+def test_reused_listing_reads_current_sizes(monkeypatch, tmp_path):
+    # Arrange
+    create_files(tmp_path, 3)
+    past = os.stat(tmp_path).st_mtime - 10
+    os.utime(tmp_path, (past, past))
+    handler = DeleteHandler(tmp_path, "*.txt")
+    handler.delete_by_amount(3)
+    # growing files in place does not change the modification time of the directory
+    for name in ("file1.txt", "file2.txt"):
+        with open(tmp_path / name, "ab") as file:
+            file.write(b"0" * 975)
     os_mock = Mock()
-    shutil_mock = Mock(return_value=(1000, 950, 50))
-    filesize_mock = Mock(return_value=25)
-    len_mock = Mock(return_value=[0,1,2])
-    monkeypatch.setattr(shutil, "disk_usage", shutil_mock)
+    monkeypatch.setattr(shutil, "disk_usage", Mock(return_value=(10000, 9500, 500)))
     monkeypatch.setattr(os, "remove", os_mock)
-    monkeypatch.setattr(glob, "glob",len_mock)
-    monkeypatch.setattr(os.path, "getsize", filesize_mock)
-    expected_path = tmp_path / Path("*.txt" + ".log")
+    monkeypatch.setattr(os, "unlink", os_mock)
+
     # Act
-    deletehandler_obj_helper_two.delete_by_disk_space(usage_limit)
-    
+    handler.delete_by_disk_space(0.9)
+
     # Assert
     assert os_mock.call_count == 2
-    assert os.path.exists(expected_path)
\ No newline at end of file
+
+def test_file_deleted_during_scan(monkeypatch, tmp_path):
+    # Arrange
+    create_files(tmp_path, 3)
+    scandir = os.scandir
+    @contextlib.contextmanager
+    def scandir_then_delete(path):
+        with scandir(path) as entries:
+            listed_entries = list(entries)
+        # another process deletes a file after the directory has been read
+        if os.path.exists(tmp_path / "file0.txt"):
+            os.remove(tmp_path / "file0.txt")
+        yield listed_entries
+    monkeypatch.setattr(os, "scandir", scandir_then_delete)
+    handler = DeleteHandler(tmp_path, "*.txt")
+
+    # Act
+    handler.delete_by_amount(1)
+
+    # Assert
+    assert [file.name for file in tmp_path.glob("*.txt")] == ["file2.txt"]
+
+def test_delete_by_amount_fixed_name(monkeypatch, tmp_path):
+    # Arrange
+    create_files(tmp_path, 3)
+    handler = DeleteHandler(tmp_path, "file1.txt")
+    scandir_mock = Mock(wraps=os.scandir)
+    monkeypatch.setattr(os, "scandir", scandir_mock)
+
+    # Act
+    handler.delete_by_amount(0)
+
+    # Assert
+    assert scandir_mock.call_count == 0
+    assert sorted(file.name for file in tmp_path.glob("*.txt")) == ["file0.txt", "file2.txt"]
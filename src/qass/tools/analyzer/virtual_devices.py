@@ -35,9 +35,11 @@ from Analyzer.Core import Log_IF
 # to not block the Analyzer4D software when reading data each virtual device works in its own thread.
 from PySide2.QtCore import QThread, QByteArray, Slot, QElapsedTimer
 from PySide2.QtWidgets import QDialog
-from threading import Lock
+from collections import deque
+from threading import Event
 
 from abc import ABC, abstractmethod
+import numpy as np
 import traceback
 from typing import List, Dict, Tuple
 import json
@@ -140,8 +142,12 @@ class VirtualInputDevice(ABC):
     def get_data(self) -> List[float]:
         """Fetch the data from the device and convert it to a List of floats.
         Note: Ensure that the data type is float and not np.float or anything else!
+        A numpy array may be returned instead of a list, it is converted with ndarray.tolist().
         This method should always clear the device's buffer containing the data when it's called.
         This is to prevent old data from persisting.
+        The method is called in the device's own thread, but it holds the GIL like all Python code.
+        Blocking reads should use libraries that release the GIL while waiting (e.g. pyserial, socket),
+        otherwise other devices and the Analyzer4D python interface are stalled in the meantime.
 
         :return: The list of new values. The list must not contain old values!
         :rtype: List[float]
@@ -161,6 +167,16 @@ class VirtualInputDevice(ABC):
         """
         return None
 
+    def has_config_dialog(self) -> bool:
+        """has_config_dialog tells whether config_dialog() provides a dialog without creating it.
+        By default this is assumed if config_dialog() is overridden.
+        Override this function if your config_dialog() may return None anyway.
+
+        :return: True if the device provides a config dialog.
+        :rtype: bool
+        """
+        return type(self).config_dialog is not VirtualInputDevice.config_dialog
+
     @property
     def requests_per_sec(self):
         return self._config['request_rate']
@@ -255,6 +271,7 @@ class MultiStreamVirtualInputDevice(VirtualInputDevice):
         """Fetch the data for all streams and convert them to a Tuple of List of floats.
         The tuple is expected to have stream_count elements.
         Note: Ensure that the data type is float and not np.float or anything else!
+        The lists may be replaced by numpy arrays, they are converted with ndarray.tolist().
         This method should always clear the device's buffer containing the data when it's called.
         This is to prevent old data from persisting.
 
@@ -270,29 +287,35 @@ class _DeviceThread(QThread):
     The thread is startet when a measurement starts.
     Inside this thread communication to the device takes place.
     """
+    # without a request rate the thread only yields between the requests while the device delivers data.
+    # After IDLE_BACKOFF_NS without any data it sleeps IDLE_SLEEP_S between the requests to free the core.
+    IDLE_BACKOFF_NS = 1_000_000_000
+    IDLE_SLEEP_S = 0.001
+
     def __init__(self, device: VirtualInputDevice):
         super().__init__()
 
         self.should_stop = False
-        self.values = []
-        self.lock = Lock()
+        # set by stop() to wake the thread from its wait for the next request
+        self._stop_event = Event()
+        self.values = ()
         self.device = device
 
     def fetch_values(self, stream: int) -> List[float]:
         """fetch_values is called by the interface from the reading thread in the Analyzer4D software.
-        It first aqcuires the lock to prevent race conditions when fetching the values.
+        The values of each stream are kept in a deque which is appended by the device thread and consumed from the left here.
+        Both operations are thread safe, so no lock is needed. Values added while fetching are returned by the next call.
 
         :return: The list of currently available values.
         :rtype: List[float]
         """
-        with self.lock:
-            vals = self.values[stream].copy()
-            self.values[stream].clear()
-
-        return vals
+        values = self.values[stream]
+        popleft = values.popleft
+        return [popleft() for _ in range(len(values))]
 
     def stop(self):
         self.should_stop = True
+        self._stop_event.set()
 
     def run(self):
         """The run method is implicitly called by the QThread class.
@@ -305,48 +328,71 @@ class _DeviceThread(QThread):
         try:
             request_rate = self.device.requests_per_sec
 
+            elapsed = QElapsedTimer()
+            elapsed.start()
             if request_rate:
-                elapsed = QElapsedTimer()
-                elapsed.start()
-                read_counter = 0
+                # the calls are scheduled on fixed deadlines, so the time spent in get_data does not add up
+                period_ns = int(1e9 / request_rate)
+                deadline_ns = 0
+            else:
+                idle_backoff_ns = self.IDLE_BACKOFF_NS
+                idle_sleep_s = self.IDLE_SLEEP_S
+                last_data_ns = 0
 
             self.should_stop = False
-            with self.lock:
-                self.values = tuple(list() for _ in range(self.device.stream_count))
+            self._stop_event.clear()
+            values = self.values = tuple(deque() for _ in range(self.device.stream_count))
 
-            self.device.open_connection()
+            # bind everything used in the loop to locals
+            device = self.device
+            get_data = device.get_data
+            single_stream = device.stream_count == 1
+            wait_for_stop = self._stop_event.wait
+            nsecs_elapsed = elapsed.nsecsElapsed
+
+            device.open_connection()
 
             # empty the data queue at start - we do not want to use old data
-            if self.device.dont_close:
-                self.device.get_data()
+            if device.dont_close:
+                get_data()
 
 
             while not self.should_stop:
-                new_data = self.device.get_data()
-                if not isinstance(new_data, Sequence):
-                    raise ValueError(f'Device {self.device.name} get_data must return a Sequence but returned {type(new_data)}')
+                new_data = get_data()
+                if isinstance(new_data, np.ndarray):
+                    # converts all values (and rows of multiple streams) to python floats in one go
+                    new_data = new_data.tolist()
+                elif not isinstance(new_data, Sequence):
+                    raise ValueError(f'Device {device.name} get_data must return a Sequence but returned {type(new_data)}')
 
                 if new_data:
                     first_elem = new_data[0]
-                    if not isinstance(first_elem, Sequence):
-                        if self.device.stream_count != 1:
-                            raise ValueError(f'Device {self.device.name} get_data must return a Sequence of Sequences since it has multiple streams.')
-                        with self.lock:
-                            self.values[0].extend(new_data)
+                    if not isinstance(first_elem, (Sequence, np.ndarray)):
+                        if not single_stream:
+                            raise ValueError(f'Device {device.name} get_data must return a Sequence of Sequences since it has multiple streams.')
+                        values[0].extend(new_data)
                     else:
-                        with self.lock:
-                            for idx, d in enumerate(new_data):
-                                self.values[idx].extend(d)
+                        for idx, d in enumerate(new_data):
+                            values[idx].extend(d.tolist() if isinstance(d, np.ndarray) else d)
 
                 if request_rate:
-                    read_counter += 1
-                    elapsed_should = 1/request_rate * 1e9 * read_counter
-                    elapsed_is = elapsed.nsecsElapsed()
-                    wait_time = int((elapsed_should - elapsed_is) / 1e3)
-                    if wait_time > 0:
-                        QThread.usleep(wait_time)
+                    deadline_ns += period_ns
+                    wait_time_ns = deadline_ns - nsecs_elapsed()
+                    # no sleep if the thread is already behind its schedule
+                    if wait_time_ns > 0:
+                        wait_for_stop(wait_time_ns / 1e9)
+                    elif wait_time_ns < -period_ns:
+                        # more than one period behind (e.g. a slow get_data): restart the schedule from now
+                        # instead of calling get_data back to back until the missed deadlines are caught up
+                        deadline_ns -= wait_time_ns
                 else:
-                    self.yieldCurrentThread()
+                    now_ns = nsecs_elapsed()
+                    if new_data:
+                        last_data_ns = now_ns
+                    if now_ns - last_data_ns < idle_backoff_ns:
+                        self.yieldCurrentThread()
+                    else:
+                        wait_for_stop(idle_sleep_s)
 
             if not self.device.dont_close:
                 self.device.close_connection()
@@ -389,6 +435,10 @@ class DeviceTypeCollection(VirtDeviceInterface):
         for name, dev in self._devices.items():
             self._device_threads[name] = _DeviceThread(dev)
 
+        # whether any device provides a config dialog, determined on the first call of capabilities()
+        # and dropped whenever a device config may have changed
+        self._has_config_dialog = None
+
     def init(self):
         """
         This function is called by the Analyzer4D software.
@@ -405,16 +455,17 @@ class DeviceTypeCollection(VirtDeviceInterface):
         The 'configdialog' is a boolean indicating whether a QDialog will be displayed
         Missing keys in the config will
 
+        The interface configs are built from the current device configs on every call,
+        whether a config dialog is available is determined once until a device's config is set or applied.
+
         :return: A dictionary containing information about this device class and the devices themselves.
         :rtype: Dict
         """
-        interfaces_conf = []
+        if self._has_config_dialog is None:
+            self._has_config_dialog = any(dev.has_config_dialog() for dev in self._devices.values())
 
-        has_config = False
+        interfaces_conf = []
         for name, dev in self._devices.items():
-            if dev.config_dialog() is not None:
-                has_config = True
-
             int_conf = {
                 'ifaceName': name,
                 'sampleRate': dev.sample_rate,
@@ -432,7 +483,7 @@ class DeviceTypeCollection(VirtDeviceInterface):
 
         config = {
             'inputs': interfaces_conf,
-            'configdialog': has_config
+            'configdialog': self._has_config_dialog
         }
         return config
 
@@ -558,13 +609,13 @@ class DeviceTypeCollection(VirtDeviceInterface):
             # We have to do the conversion differently.
             #json_str = bytes(data).decode()
 
-            json_str = ''
-            for c in data:
-                json_str += c.decode()
+            # iterating the QByteArray yields single bytes, join them once instead of growing a string per byte
+            json_bytes = b''.join(data)
 
-            if json_str:
-                config_dict = json.loads(json_str)
+            if json_bytes:
+                config_dict = json.loads(json_bytes)
                 self._devices[name].set_config(config_dict)
+                self._has_config_dialog = None
             return True
         except Exception as e:
             Log_IF.popupError(f'Exception caught during setting config to virtual device {name}:\n{traceback.format_exc()}')
@@ -580,6 +631,7 @@ class DeviceTypeCollection(VirtDeviceInterface):
         :rtype: bool
         """
         try:
+            self._has_config_dialog = None
             self._devices[name].apply_config()
             return True
         except Exception as e: